@@ -1,7 +1,17 @@
 import json
-import math
 import os
 import sys
+import queue
+try:
+    import orjson
+except ImportError:
+    # fall back to the stdlib encoder when orjson is not installed
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    # only required when MQTT_PAYLOAD_FORMAT=msgpack
+    msgpack = None
 import paho.mqtt.client as mqtt
 from paho.mqtt.client import MQTTMessage
 from pymongo import MongoClient
@@ -11,8 +21,10 @@ from pymongo.errors import ConnectionFailure
 from ros_data import ros_data_t
 import rclpy
 from rclpy.node import Node
+from rclpy.logging import LoggingSeverity
 import threading
 import time
+import traceback
 
 
 # ---------------------- SECURE EXECUTION ----------------------
@@ -39,10 +51,73 @@ enforce_shell_parent()
 MQTT_DEFAULT_HOST = "localhost"
 MQTT_DEFAULT_PORT = 1883
 MQTT_DEFAULT_TIMEOUT = 120
+MQTT_MAX_INFLIGHT = 1000
+MQTT_MAX_QUEUED = 100000
+MQTT_RECONNECT_MIN_DELAY = 1   # seconds
+MQTT_RECONNECT_MAX_DELAY = 30  # seconds
+MQTT_RAW_QUEUE_MAXSIZE = 10000  # received payloads waiting to be decoded (oldest dropped)
+MQTT_DROP_LOG_INTERVAL_SEC = 5.0  # min time between "dropped payloads" warnings
+# Telemetry is fire-and-forget: no broker ACK and no wait_for_publish()
+MQTT_PUBLISH_QOS = 0
+MQTT_PUBLISH_RETAIN = False
+# Sampling windows can be aggregated into one {"windows": [...]} MQTT message
+# of up to N windows (MQTT_WINDOWS_PER_MESSAGE env var), held back at most
+# MQTT_WINDOWS_MAX_AGE_SEC seconds. The default of 1 publishes each window
+# as a bare dict, the format Telegraf/InfluxDB and fast_api_bridge.py expect.
+MQTT_WINDOWS_PER_MESSAGE = int(os.getenv("MQTT_WINDOWS_PER_MESSAGE", "1"))
+if MQTT_WINDOWS_PER_MESSAGE < 1:
+    raise ValueError(f"Unsupported MQTT_WINDOWS_PER_MESSAGE: {MQTT_WINDOWS_PER_MESSAGE}")
+MQTT_WINDOWS_MAX_AGE_SEC = float(os.getenv("MQTT_WINDOWS_MAX_AGE_SEC", "2.0"))
+if MQTT_WINDOWS_MAX_AGE_SEC < 0:
+    raise ValueError(f"Unsupported MQTT_WINDOWS_MAX_AGE_SEC: {MQTT_WINDOWS_MAX_AGE_SEC}")
+# Wire format of the MQTT -> Telegraf leg: "json" or "msgpack".
+# Must match data_format of the Telegraf mqtt_consumer input.
+MQTT_PAYLOAD_FORMAT = os.getenv("MQTT_PAYLOAD_FORMAT", "json").lower()
+if MQTT_PAYLOAD_FORMAT not in ("json", "msgpack"):
+    raise ValueError(f"Unsupported MQTT_PAYLOAD_FORMAT: {MQTT_PAYLOAD_FORMAT}")
+if MQTT_PAYLOAD_FORMAT == "msgpack" and msgpack is None:
+    raise ImportError("MQTT_PAYLOAD_FORMAT=msgpack requires the 'msgpack' package")
 
 JSON_GLOBAL_TOPIC = "global/json"
 MQTT_GLOBAL_TOPIC = "mqtt/global"
 
+# MongoDB Settings
+MONGO_BATCH_SIZE = 64           # documents per insert_many
+MONGO_FLUSH_INTERVAL_SEC = 2.0  # max age of a pending batch
+MONGO_QUEUE_MAXSIZE = 10000     # documents waiting for the writer thread (oldest dropped)
+
+
+def json_loads(raw: bytes):
+    """Decode a raw MQTT payload (bytes) into Python objects."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw.decode("utf-8"))
+
+
+def json_dumps(data: dict) -> bytes:
+    """Encode data as compact JSON bytes, passed to paho without re-encoding."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def encode_payload(data: dict) -> bytes:
+    """Encode data for the MQTT -> Telegraf leg in MQTT_PAYLOAD_FORMAT."""
+    if MQTT_PAYLOAD_FORMAT == "msgpack":
+        return msgpack.packb(data, use_bin_type=True)
+    return json_dumps(data)
+
+
+def to_columnar(rows: list, keys=None) -> dict:
+    """
+    Convert a list of dicts into a dict of parallel lists, e.g.
+      [{"id": 1, "cswi": 0.1}, {"id": 2}] -> {"id": [1, 2], "cswi": [0.1, None]}
+    keys defaults to the union of all row keys in first-seen order.
+    """
+    if keys is None:
+        keys = list(dict.fromkeys(k for row in rows for k in row))
+    return {k: [row.get(k) for row in rows] for k in keys}
+
 
 """
 SERVERSIDE - THIS SCRIPT MUST BE EXECUTED ON THE SERVER!!!
@@ -57,9 +132,25 @@ class mqtt_data_uploader_t(Node):
         super().__init__('ros2_mqtt_publisher')
 
         self.ros_data = ros_data_t()
-        self.mqtt_client_server = mqtt.Client()
-        # timestamp of last received MQTT message (seconds since epoch)
-        self.last_msg_time = 0
+        # paho-mqtt >= 2.0 callback API; no enable_logger() to keep per-message logging off
+        self.mqtt_client_server = mqtt.Client(
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv5)
+        self.mqtt_client_server.max_inflight_messages_set(MQTT_MAX_INFLIGHT)
+        self.mqtt_client_server.max_queued_messages_set(MQTT_MAX_QUEUED)
+        self.mqtt_client_server.reconnect_delay_set(
+            min_delay=MQTT_RECONNECT_MIN_DELAY, max_delay=MQTT_RECONNECT_MAX_DELAY)
+        # raw MQTT payloads handed from the paho network thread to _drain_raw
+        self._raw_queue = queue.Queue(maxsize=MQTT_RAW_QUEUE_MAXSIZE)
+        # payloads dropped by on_mqtt_message, only ever incremented (reported by _drain_raw)
+        self._raw_dropped = 0
+        # set by _drain_raw for every decoded message, cleared per sampling window
+        self._msg_event = threading.Event()
+        # pending MongoDB documents, written in batches by the _mongo_writer thread
+        self._mongo_queue = queue.Queue(maxsize=MONGO_QUEUE_MAXSIZE)
+        self._mongo_thread = threading.Thread(target=self._mongo_writer, daemon=True)
+        # sampling windows waiting to be published, see flush_pending_windows()
+        self._pending_windows: list[dict] = []
+        self._pending_since = 0.0
 
         try:
             # ---------------------- MONGO CONNECTION ----------------------
@@ -76,6 +167,7 @@ class mqtt_data_uploader_t(Node):
             # Access the target database and collection
             # use the same collection as before ("Test") to keep historic format
             self.mongo_db_collection = self.client["ROS2"]["Alex Test"]
+            self._mongo_thread.start()
             # --------------------------------------------------------------
 
             # ---------------------- MQTT CONNECTION ----------------------
@@ -96,6 +188,9 @@ class mqtt_data_uploader_t(Node):
         except Exception as me:
             self.get_logger().error(f"Failed to connect to MQTT broker: {me}")
 
+        # Decode/update on a separate thread so the paho loop only enqueues bytes
+        threading.Thread(target=self._drain_raw, daemon=True).start()
+
         # Start MQTT listener loop
         self.mqtt_client_server.loop_start()
 
@@ -108,40 +203,152 @@ class mqtt_data_uploader_t(Node):
 
     def on_mqtt_message(self, client, userdata, msg: MQTTMessage):
         """Callback when a message is received from MQTT."""
-        try:
-            payload = json.loads(msg.payload.decode("utf-8"))
-            print(f"[DEBUG] MQTT Received raw: {payload}")
+        # keep the network thread free: decoding happens in _drain_raw
+        while True:
+            try:
+                self._raw_queue.put_nowait(msg.payload)
+                return
+            except queue.Full:
+                try:
+                    self._raw_queue.get_nowait()
+                    # no logging here: _drain_raw reports drops off the network thread
+                    self._raw_dropped += 1
+                except queue.Empty:
+                    pass
+
+
+    def _drain_raw(self):
+        """Decode queued MQTT payloads and update ros_data."""
+        logger = self.get_logger()
+        reported_drops = 0
+        last_drop_log = 0.0
+        while True:
+            raw = self._raw_queue.get()
+            dropped = self._raw_dropped
+            if dropped != reported_drops and time.time() - last_drop_log >= MQTT_DROP_LOG_INTERVAL_SEC:
+                logger.warning(f"MQTT receive queue full; dropped {dropped - reported_drops} oldest messages.")
+                reported_drops = dropped
+                last_drop_log = time.time()
+            try:
+                payload = json_loads(raw)
+                # the payload repr is expensive: only build it when debug is on
+                if logger.is_enabled_for(LoggingSeverity.DEBUG):
+                    logger.debug(f"MQTT Received raw: {payload}")
 
-            # mark last message time so publisher knows new data arrived
-            self.last_msg_time = time.time()
-            self.ros_data._is_data_available = True
-            self.ros_data.update(payload)
+                self.ros_data.is_data_available = True
+                self.ros_data.update(payload)
+                # wake the publisher: new data arrived
+                self._msg_event.set()
 
-        except Exception as e:
-            self.get_logger().error(f"Error processing MQTT message: {e}")
+            except Exception as e:
+                # ros_data.update() does not catch handler bugs: keep the traceback
+                logger.error(f"Error processing MQTT message: {e}\n{traceback.format_exc()}")
 
 
     def publish(self, topic: str, data: dict) -> None:
-        """Publish data to MQTT and store it in MongoDB."""
+        """Store a sampling window in MongoDB and queue it for MQTT."""
         if data:
             try:
-                payload = json.dumps(data, indent=4)
+                # Queue raw JSON for MongoDB (written in batches by _mongo_writer).
+                # insert_many adds "_id" to each document, so store a shallow
+                # copy and keep the published dict unchanged.
+                self._queue_for_mongo(data.copy())
+
+                # With MQTT_WINDOWS_PER_MESSAGE > 1, several windows are sent
+                # together as one {"windows": [...]} message
+                if not self._pending_windows:
+                    self._pending_since = time.time()
+                self._pending_windows.append(data)
+                if (len(self._pending_windows) >= MQTT_WINDOWS_PER_MESSAGE
+                        or time.time() - self._pending_since >= MQTT_WINDOWS_MAX_AGE_SEC):
+                    self.flush_pending_windows(topic)
+            except Exception as e:
+                self.get_logger().error(f"Publish or MongoDB insert failed: {e}")
 
-                # Publish to MQTT for InfluxDB via Telegraf
-                self.mqtt_client_server.publish(topic, payload)
 
-                # Store raw JSON into MongoDB
-                self.mongo_db_collection.insert_one(data)
+    def flush_pending_windows(self, topic: str = JSON_GLOBAL_TOPIC) -> None:
+        """Publish all pending sampling windows to MQTT as a single message."""
+        windows, self._pending_windows = self._pending_windows, []
+        if not windows:
+            return
+        try:
+            if MQTT_WINDOWS_PER_MESSAGE == 1:
+                # aggregation disabled: keep the historic one-window-per-message format
+                payload = encode_payload(windows[0])
+            else:
+                payload = encode_payload({"windows": windows})
+
+            # Publish to MQTT for InfluxDB via Telegraf
+            # Do not wait_for_publish(): only check the message was queued
+            info = self.mqtt_client_server.publish(
+                topic, payload, qos=MQTT_PUBLISH_QOS, retain=MQTT_PUBLISH_RETAIN)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self.get_logger().warning(f"MQTT publish to {topic} not queued (rc={info.rc}).")
+
+            self.get_logger().info(f"Published {len(windows)} windows to MQTT ({topic}).")
+        except Exception as e:
+            self.get_logger().error(f"MQTT publish failed: {e}")
 
-                self.get_logger().info(f"Published to MQTT ({topic}) and stored in MongoDB.")
+
+    def _flush_stale_windows(self) -> None:
+        """Publish pending windows once the oldest is MQTT_WINDOWS_MAX_AGE_SEC old."""
+        if self._pending_windows and time.time() - self._pending_since >= MQTT_WINDOWS_MAX_AGE_SEC:
+            self.flush_pending_windows(JSON_GLOBAL_TOPIC)
+
+
+    def _queue_for_mongo(self, doc) -> None:
+        """Hand a document to the writer thread, dropping the oldest one when full."""
+        while True:
+            try:
+                self._mongo_queue.put_nowait(doc)
+                return
+            except queue.Full:
+                try:
+                    self._mongo_queue.get_nowait()
+                    self.get_logger().warning("MongoDB queue full; dropping oldest document.")
+                except queue.Empty:
+                    pass
+
+
+    def _mongo_writer(self) -> None:
+        """Write queued documents to MongoDB with insert_many, until a None sentinel."""
+        running = True
+        while running:
+            batch = []
+            doc = self._mongo_queue.get()
+            deadline = time.time() + MONGO_FLUSH_INTERVAL_SEC
+            # collect up to MONGO_BATCH_SIZE documents or until the batch is too old
+            while doc is not None:
+                batch.append(doc)
+                if len(batch) >= MONGO_BATCH_SIZE:
+                    break
+                try:
+                    doc = self._mongo_queue.get(timeout=max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    break
+            if doc is None:
+                running = False
+            if not batch:
+                continue
+            try:
+                # ordered=False so one bad document does not abort the whole batch
+                self.mongo_db_collection.insert_many(batch, ordered=False)
+                self.get_logger().info(f"Stored {len(batch)} documents in MongoDB.")
             except Exception as e:
-                self.get_logger().error(f"Publish or MongoDB insert failed: {e}")
+                self.get_logger().error(f"MongoDB insert failed: {e}")
+
+
+    def close_mongo_writer(self, timeout: float = 10.0) -> None:
+        """Flush pending documents and stop the MongoDB writer thread."""
+        if self._mongo_thread.is_alive():
+            self._queue_for_mongo(None)
+            self._mongo_thread.join(timeout)
 
 
     # def secure_data_handler(self):
     #     """Wait until ROS data becomes available."""
     #     once = True
-    #     while not self.ros_data.is_data_available():
+    #     while not self.ros_data.is_data_available:
     #         if once:
     #             self.get_logger().info("Data not available yet, waiting [...]")
     #             once = False
@@ -153,84 +360,106 @@ class mqtt_data_uploader_t(Node):
         """Main loop to aggregate and publish sensor data."""
         rd_handler = self.ros_data 
 
-        def manage_data(sample, samples: list):
-            if sample is None:
-                return
-            if isinstance(sample, float) and math.isnan(sample):
-                return
-            if sample not in samples:
-                samples.append(sample)
+        def manage_data(sample, samples: dict):
+            # samples is an insertion-ordered set: value -> sample
+            # (None/NaN are already filtered out by ros_data_t._push)
+            try:
+                samples.setdefault(sample, sample)
+            except TypeError:
+                # unhashable samples (e.g. plant dicts without an id) are keyed by their repr
+                samples.setdefault(repr(sample), sample)
 
         sampling_duration_sec = 0.5  # seconds per batch
 
+        # bind hot lookups once instead of per window
+        _sleep = time.sleep
+        drain = rd_handler.drain
+        msg_event = self._msg_event
+
         while True:
-            canopy_temperature_samples = []
-            ndvi_samples = []
-            ndvi_3d_samples = []
-            ndvi_ir_samples = []
-            ndvi_visible_samples = []
-            area_samples = []
-            location_samples = []
-            biomass_samples = []
-            crop_light_state_samples = []
-            crop_type_samples = []
-            ambient_temperature_samples = []
-            relative_humidity_samples = []
-            absolute_humidity_samples = []
-            dew_point_samples = []
-            utm_baselink_X_samples = []
-            utm_baselink_Y_samples = []
-            utm_baselink_Z_samples = []
-
-            start_time = time.time()
- 
-            while (time.time() - start_time) <= sampling_duration_sec:
-                # Flatten plant lists into a single array of objects (deduplicate/update by 'id')
-                if rd_handler.t_plants and isinstance(rd_handler.t_plants, list):
-                    # collect existing ids to avoid duplicates
-                    existing_ids = {p.get('id') for p in canopy_temperature_samples if isinstance(p, dict) and p.get('id') is not None}
-                    for plant in rd_handler.t_plants:
-                        if plant is None:
-                            continue
-                        if isinstance(plant, dict):
-                            pid = plant.get('id')
-                            if pid is not None:
-                                if pid in existing_ids:
-                                    # update existing entry with latest fields
-                                    for ex in canopy_temperature_samples:
-                                        if isinstance(ex, dict) and ex.get('id') == pid:
-                                            ex.update(plant)
-                                            break
-                                else:
-                                    canopy_temperature_samples.append(plant.copy())
-                                    existing_ids.add(pid)
+            # block until a message arrives instead of polling empty windows
+            if not msg_event.wait(timeout=sampling_duration_sec):
+                # do not hold already collected windows back while idle
+                self._flush_stale_windows()
+                continue
+            # on_mqtt_message queues every value into ros_data buffers meanwhile
+            _sleep(sampling_duration_sec)
+            msg_event.clear()
+
+            canopy_temperature_samples = {}
+            plants_by_id = {}
+            ndvi_samples = {}
+            ndvi_3d_samples = {}
+            ndvi_ir_samples = {}
+            ndvi_visible_samples = {}
+            area_samples = {}
+            location_samples = {}
+            biomass_samples = {}
+            crop_light_state_samples = {}
+            crop_type_samples = {}
+            ambient_temperature_samples = {}
+            relative_humidity_samples = {}
+            absolute_humidity_samples = {}
+            dew_point_samples = {}
+            utm_baselink_X_samples = {}
+            utm_baselink_Y_samples = {}
+            utm_baselink_Z_samples = {}
+
+            # Flatten plant lists into a single array of objects (deduplicate/update by 'id')
+            for plants in drain("t_plants"):
+                for plant in plants:
+                    if plant is None:
+                        continue
+                    if isinstance(plant, dict):
+                        pid = plant.get('id')
+                        if pid is not None:
+                            existing = plants_by_id.get(pid)
+                            if existing is not None:
+                                # update existing entry with latest fields
+                                existing.update(plant)
                             else:
-                                # no id: append if not already present
-                                if plant not in canopy_temperature_samples:
-                                    canopy_temperature_samples.append(plant.copy())
+                                plants_by_id[pid] = plant.copy()
                         else:
-                            # non-dict plant entry: keep uniqueness
-                            if plant not in canopy_temperature_samples:
-                                canopy_temperature_samples.append(plant)
-                else:
-                    # fallback for older flat-format messages (single float)
-                    manage_data(rd_handler.t_canopy_temperature, canopy_temperature_samples)
-                manage_data(rd_handler.n_ndvi, ndvi_samples)
-                manage_data(rd_handler.n_ndvi_3d, ndvi_3d_samples)
-                manage_data(rd_handler.n_ir, ndvi_ir_samples)
-                manage_data(rd_handler.n_visible, ndvi_visible_samples)
-                manage_data(rd_handler.n_area, area_samples)
-                manage_data(rd_handler.n_location, location_samples)
-                manage_data(rd_handler.n_biomass, biomass_samples)
-                manage_data(rd_handler.n_crop_light_state, crop_light_state_samples)
-                manage_data(rd_handler.n_crop_type, crop_type_samples)
-                manage_data(rd_handler.n_ambient_temperature, ambient_temperature_samples)
-                manage_data(rd_handler.n_relative_humidity, relative_humidity_samples)
-                manage_data(rd_handler.n_absolute_humidity, absolute_humidity_samples)
-                manage_data(rd_handler.n_dew_point, dew_point_samples)
-                manage_data(rd_handler.tf_x, utm_baselink_X_samples)
-                manage_data(rd_handler.tf_y, utm_baselink_Y_samples)
-                manage_data(rd_handler.tf_z, utm_baselink_Z_samples)
+                            # no id: keep unique copies
+                            manage_data(plant.copy(), canopy_temperature_samples)
+                    else:
+                        # non-dict plant entry: keep uniqueness
+                        manage_data(plant, canopy_temperature_samples)
+
+            # every value received during the window, per ros_data field
+            for name, samples in (
+                ("t_canopy_temperature", canopy_temperature_samples),  # older flat format
+                ("n_ndvi", ndvi_samples),
+                ("n_ndvi_3d", ndvi_3d_samples),
+                ("n_ir", ndvi_ir_samples),
+                ("n_visible", ndvi_visible_samples),
+                ("n_area", area_samples),
+                ("n_biomass", biomass_samples),
+                ("n_crop_light_state", crop_light_state_samples),
+                ("n_crop_type", crop_type_samples),
+                ("n_ambient_temperature", ambient_temperature_samples),
+                ("n_relative_humidity", relative_humidity_samples),
+                ("n_absolute_humidity", absolute_humidity_samples),
+                ("n_dew_point", dew_point_samples),
+                ("tf_x", utm_baselink_X_samples),
+                ("tf_y", utm_baselink_Y_samples),
+                ("tf_z", utm_baselink_Z_samples),
+            ):
+                for sample in drain(name):
+                    manage_data(sample, samples)
+            # LocationT is unhashable (mutable dataclass): dedup by its field values
+            for loc in drain("n_location"):
+                location_samples.setdefault(loc.key(), loc)
+
+            # Plants are stored column-wise ({"id": [...], "canopy_temperature": [...], ...})
+            # so field names are not repeated per plant; older flat-format
+            # messages (single floats) keep the plain list.
+            plants = list(plants_by_id.values())
+            plants.extend(p for p in canopy_temperature_samples.values() if isinstance(p, dict))
+            if plants:
+                canopy_temperature_data = to_columnar(plants)
+            else:
+                canopy_temperature_data = list(canopy_temperature_samples.values())
 
             # JSON structure to store
             json_data = {
@@ -241,45 +470,48 @@ class mqtt_data_uploader_t(Node):
                 "status": rd_handler.g_status,
                 "service": rd_handler.g_service,
 
-                "canopy_temperature_data": canopy_temperature_samples,
+                "canopy_temperature_data": canopy_temperature_data,
                 "t_entity_count": rd_handler.t_entity_count,
-                "ndvi_data": ndvi_samples,
-                "ndvi_3d_data": ndvi_3d_samples,
-                "ndvi_ir_data": ndvi_ir_samples,
-                "ndvi_visible_data": ndvi_visible_samples,
-
-                "area_data": area_samples,
-                "location_data": location_samples,
-                "biomass_data": biomass_samples,
-                "crop_light_state_data": crop_light_state_samples,
-                "crop_type_data": crop_type_samples,
-
-                "ambient_temperature_data": ambient_temperature_samples,
-                "relative_humidity_data": relative_humidity_samples,
-                "absolute_humidity_data": absolute_humidity_samples,
-                "dew_point_data": dew_point_samples,
-
-                "utm_baselink_X": utm_baselink_X_samples,
-                "utm_baselink_Y": utm_baselink_Y_samples,
-                "utm_baselink_Z": utm_baselink_Z_samples,
+                "ndvi_data": list(ndvi_samples.values()),
+                "ndvi_3d_data": list(ndvi_3d_samples.values()),
+                "ndvi_ir_data": list(ndvi_ir_samples.values()),
+                "ndvi_visible_data": list(ndvi_visible_samples.values()),
+
+                "area_data": list(area_samples.values()),
+                "location_data": [loc.to_dict() for loc in location_samples.values()],
+                "biomass_data": list(biomass_samples.values()),
+                "crop_light_state_data": list(crop_light_state_samples.values()),
+                "crop_type_data": list(crop_type_samples.values()),
+
+                "ambient_temperature_data": list(ambient_temperature_samples.values()),
+                "relative_humidity_data": list(relative_humidity_samples.values()),
+                "absolute_humidity_data": list(absolute_humidity_samples.values()),
+                "dew_point_data": list(dew_point_samples.values()),
+
+                "utm_baselink_X": list(utm_baselink_X_samples.values()),
+                "utm_baselink_Y": list(utm_baselink_Y_samples.values()),
+                "utm_baselink_Z": list(utm_baselink_Z_samples.values()),
             }
 
             # Only publish if there is actual data collected
             all_samples = [
-                canopy_temperature_samples, ndvi_samples, ndvi_3d_samples, ndvi_ir_samples,
+                plants_by_id, canopy_temperature_samples, ndvi_samples, ndvi_3d_samples, ndvi_ir_samples,
                 ndvi_visible_samples, area_samples, location_samples, biomass_samples,
                 crop_light_state_samples, crop_type_samples, ambient_temperature_samples,
                 relative_humidity_samples, absolute_humidity_samples, dew_point_samples,
                 utm_baselink_X_samples, utm_baselink_Y_samples, utm_baselink_Z_samples
             ]
-            # Publish only if at least one message arrived during the sampling window
-            # (prevents re-publishing the last-known values when sender stopped)
-            if self.last_msg_time >= start_time and any(samples for samples in all_samples):
+            # buffers only hold values received since the last window, so the
+            # last-known values are never re-published when the sender stopped
+            if any(samples for samples in all_samples):
                 # Publish to both MQTT and MongoDB
                 self.publish(JSON_GLOBAL_TOPIC, json_data)
             else:
-                # no new messages in this sampling window -> skip publishing
+                # no new samples in this sampling window -> skip publishing
                 self.get_logger().debug("No new MQTT data in sampling window; skipping publish.")
+            # messages that fill no buffer (e.g. GPS) still set msg_event, so
+            # the wait() above may never time out: check the age here as well
+            self._flush_stale_windows()
 
 
 def main(args=None):
@@ -291,6 +523,8 @@ def main(args=None):
     except KeyboardInterrupt:
         pass
     finally:
+        node.flush_pending_windows()
+        node.close_mongo_writer()
         node.mqtt_client_server.disconnect()
         node.get_logger().info("Disconnected from MQTT broker.")
         node.destroy_node()
@@ -1,13 +1,112 @@
-from dataclasses import dataclass
+import logging
+import os
+from collections import deque
+from dataclasses import dataclass, field
 import re
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, ClassVar, List, TypedDict, Union
+
+log = logging.getLogger(__name__)
+
+# Fields sampled by the publishing loop: update() appends every observed
+# value to a bounded per-field deque, the publisher drains them per window.
+BUFFERED_FIELDS = (
+    "t_canopy_temperature", "t_plants",
+    "n_ndvi", "n_ndvi_3d", "n_ir", "n_visible",
+    "n_area", "n_location", "n_biomass", "n_crop_light_state", "n_crop_type",
+    "n_ambient_temperature", "n_relative_humidity", "n_absolute_humidity", "n_dew_point",
+    "tf_x", "tf_y", "tf_z",
+)
+BUFFER_MAXLEN = 1024
+
+# Patterns used on every location / temperature message
+_FLOAT_RE = re.compile(r'([-+]?[0-9]*\.?[0-9]+)')
+_ROW_RE = re.compile(r'(\d+)(?:\s*-\s*(\d+))?')
+# one "key: value" (or bare value) part of a comma separated location string;
+# the key ends at the first colon, the value may contain further colons
+_LOC_PART_RE = re.compile(r'(?:^|,)\s*(?:(?P<key>[^:,]*):)?(?P<val>[^,]*)')
+_PLANT_PAIR_RE = re.compile(r'([a-zA-Z\s]+)\s*=\s*([-\d.]+)')
+_PLANT_ID_RE = re.compile(r'Objeto\s+(\d+)')
+
+def _make_buffers() -> Dict[str, deque]:
+    return {name: deque(maxlen=BUFFER_MAXLEN) for name in BUFFERED_FIELDS}
+
+
+def _canopy_mean(plants: list) -> Optional[float]:
+    """Mean canopy_temperature over plant dicts (None when no plant has one)."""
+    # single pass: one get per plant, no temporary list
+    total = 0.0
+    count = 0
+    for p in plants:
+        v = p.get("canopy_temperature")
+        if v is not None:
+            try:
+                total += float(v)
+                count += 1
+            except (TypeError, ValueError):
+                pass
+    return total / count if count else None
+
+
+# Decoded payloads of the hand-written handlers (the copy-only message
+# types are described by _COPY_SCHEMA). Typing only: handlers read the
+# decoder's dict directly.
+class LocationMsg(TypedDict, total=False):
+    msg_type: str
+    location: Union[str, Dict[str, Any]]  # "section: ..., row: ..." or already split
+
+
+class TemperatureMsg(TypedDict, total=False):
+    msg_type: str
+    plants: List[Union[str, Dict[str, Any]]]  # "Objeto 8: Temperatura = ..." or plant dicts
+    entity_count: int
+    canopy_temperature: float  # older flat format
+    cwsi: float
+
+
+class TfPositionMsg(TypedDict, total=False):
+    msg_type: str
+    x: float
+    y: float
+    z: float
+    point: Dict[str, float]  # {"x": ..., "y": ..., "z": ...} when not flattened
+
+
+@dataclass(slots=True)
+class LocationT:
+    """Normalized location of a sample (see _parse_location_string)."""
+    section: Optional[str] = None
+    row: Optional[str] = None
+    position_from_N: Optional[float] = None
+    direction: Optional[str] = None
+    extra: Optional[Dict[str, str]] = None  # unknown "key: value" parts, kept raw
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain dict for serialization (JSON, msgpack, BSON)."""
+        out = {
+            "section": self.section,
+            "row": self.row,
+            "position_from_N": self.position_from_N,
+            "direction": self.direction,
+        }
+        if self.extra:
+            out.update(self.extra)
+        return out
+
+    def key(self) -> tuple:
+        """Hashable value of all fields, used to deduplicate samples."""
+        return (self.section, self.row, self.position_from_N, self.direction,
+                tuple(sorted(self.extra.items())) if self.extra else ())
 
 # A helper class to store and update data from ROS messages.
 
-@dataclass
+@dataclass(slots=True, eq=False, repr=False)
 class ros_data_t:
     
-    _is_data_available: bool = False
+    # Averaging the plants list is only needed by consumers of the legacy
+    # t_canopy_temperature scalar; set COMPUTE_CANOPY_AVG=1 to keep it.
+    COMPUTE_CANOPY_AVG: ClassVar[bool] = os.getenv("COMPUTE_CANOPY_AVG", "0") == "1"
+
+    is_data_available: bool = False
     
     # Raw fields
     
@@ -25,7 +124,7 @@ class ros_data_t:
     n_ir: float = None
     n_visible: float = None
     n_area: float = None
-    n_location: Optional[Dict[str, Any]] = None
+    n_location: Optional[LocationT] = None
     n_biomass: float = None
     n_crop_light_state: str = None
     n_crop_type: str = None
@@ -38,138 +137,256 @@ class ros_data_t:
     tf_z: float = None
     t_plants: list = None  # list of dicts for canopy temperature data per plant
 
+    # per-field sample buffers (single producer: update, single consumer: drain)
+    buffers: Dict[str, deque] = field(default_factory=_make_buffers, repr=False)
+    # handler of the previous msg_type: periodic streams repeat the same type
+    _last_msg: str = field(default="", init=False, repr=False)
+    _last_handler: Any = field(default=None, init=False, repr=False)
+
 
     def update(self, data: dict):
         msg: str = data.get("msg_type")
         
         if not msg:
-            print(f"[WARN] Skipping message without msg_type: {data}")
+            log.warning("Skipping message without msg_type: %s", data)
             return
-        
-        try:
-            # GPS / position messages: prefer "ts" then "timestamp
-            if "gps" in msg:
-                self.g_timestamp = data.get("ts", data.get("timestamp"))
-                self.g_latitude = data.get("latitude")
-                self.g_longitude = data.get("longitude")
-                self.g_altitude = data.get("altitude")
-                self.g_status = data.get("status")
-                self.g_service = data.get("service")
-
-            elif "ambient_temperature" in msg:
-                self.n_ambient_temperature = data.get("ambient_temperature", data.get("ambient_temperature"))
-
-            # NDVI messages: accept variant field names
-            elif "ndvi" in msg:
-                self.n_ndvi = data.get("ndvi", data.get("ndvi_value"))
-                self.n_ndvi_3d = data.get("ndvi_3d", data.get("ndvi3d"))
-                # some payloads use ndvi_ir / ndvi_visible or ndvi_ir / ndvi_visible keys
-                self.n_ir = data.get("ndvi_ir", data.get("ir"))
-                self.n_visible = data.get("ndvi_visible", data.get("visible"))
-
-            elif "area" in msg:
-                self.n_area = data.get("area")
-
-            elif "location" in msg:
-                # Accept either already-structured dict or a single location string
-                loc = data.get("location")
-                if isinstance(loc, dict):
-                    # try to normalize/ensure keys
-                    parsed = {
-                        "section": loc.get("section"),
-                        "row": loc.get("row"),
-                        "position_from_N": None,
-                        "direction": loc.get("direction")
-                    }
-                    # try to parse position if present as string
-                    pos = loc.get("position_from_N") or loc.get("position") or loc.get("position_from_n")
-                    if pos is not None:
-                        try:
-                            parsed['position_from_N'] = float(re.search(r'([-+]?[0-9]*\.?[0-9]+)', str(pos)).group(1))
-                        except Exception:
-                            parsed['position_from_N'] = None
-                    self.n_location = parsed
-                elif isinstance(loc, str):
-                    self.n_location = _parse_location_string(loc)
-                else:
-                    self.n_location = None
-
-            elif "biomass" in msg:
-                self.n_biomass = data.get("biomass")
-
-            elif "light_state" in msg:
-                # some payloads use crop_light_state or light_state
-                self.n_crop_light_state = data.get("crop_light_state", data.get("light_state"))
-
-            elif "crop_type" in msg:
-                self.n_crop_type = data.get("crop_type")
-
-            # Temperature messages: keep full plants list so canopy_temperature_data is nested array
-            elif "temperature" in msg:
-                plants = data.get("plants")
-                if plants and isinstance(plants, list):
-                    processed_plants = []
-                    for p in plants:
-                        if isinstance(p, str):
-                            parsed = _parse_plant_string(p)
-                            if parsed:
-                                processed_plants.append(parsed)
-                        elif isinstance(p, dict):
-                            processed_plants.append(p)
-
-                    self.t_plants = processed_plants
-                    # entity count fallback
-                    self.t_entity_count = data.get("entity_count", len(self.t_plants))
-                    # keep an average for backward compatibility (optional)
-                    try:
-                        temps = [float(p.get("canopy_temperature")) for p in self.t_plants if p.get("canopy_temperature") is not None]
-                        self.t_canopy_temperature = sum(temps) / len(temps) if temps else None
-                    except Exception:
-                        self.t_canopy_temperature = None
-                else:
-                    # older flat format
-                    self.t_entity_count = data.get("entity_count")
-                    self.t_canopy_temperature = data.get("canopy_temperature")
-                    self.t_cswi = data.get("cwsi")
-
-            elif "relative_humidity" in msg:
-                self.n_relative_humidity = data.get("relative_humidity", data.get("humidity"))
-
-            elif "absolute_humidity" in msg:
-                self.n_absolute_humidity = data.get("absolute_humidity")
-
-            elif "dew_point" in msg:
-                self.n_dew_point = data.get("dew_point")
-
-            elif "tf_position" in msg:
-                # store tf/utm baselink values (x,y,z)
-                if "x" in data and "y" in data and "z" in data:
-                    try:
-                        self.tf_x = float(data.get("x"))
-                        self.tf_y = float(data.get("y"))
-                        self.tf_z = float(data.get("z"))
-                    except Exception:
-                        self.tf_x = data.get("x"); self.tf_y = data.get("y"); self.tf_z = data.get("z")
-                elif "point" in data and isinstance(data["point"], dict):
-                    p = data["point"]
-                    try:
-                        self.tf_x = float(p.get("x")); self.tf_y = float(p.get("y")); self.tf_z = float(p.get("z"))
-                    except Exception:
-                        self.tf_x = p.get("x"); self.tf_y = p.get("y"); self.tf_z = p.get("z")
+        if type(msg) is not str:
+            log.warning("Skipping message with non-string msg_type: %s", data)
+            return
+
+        # no sys.intern(): msg_type is sender-controlled and interned strings
+        # are never freed; == on short strings is already cheap
+        if msg == self._last_msg:
+            handler = self._last_handler
+        else:
+            # exact msg_type match first, substring match for variants (e.g. "gps_fix")
+            handler = _HANDLERS.get(msg)
+            if handler is None:
+                handler = _match_handler(msg)
+            self._last_msg = msg
+            self._last_handler = handler
+        if handler is not None:
+            handler(self, data)
+        # unknown messages: keep raw if needed
+
+        # mark data available for your publishing loop
+        self.is_data_available = True
 
+    def _handle_location(self, data: LocationMsg):
+        # Accept either already-structured dict or a single location string
+        loc = data.get("location")
+        if type(loc) is dict:
+            get = loc.get
+            # position may already be numeric, or a string such as "11.64 m"
+            pos = get("position_from_N") or get("position") or get("position_from_n")
+            if isinstance(pos, (int, float)):
+                pos = float(pos)
+            elif type(pos) is str:
+                pos = _extract_float(pos)
+            elif pos is not None:
+                pos = _extract_float(str(pos))
+            # normalize to the known keys
+            self._push("n_location", LocationT(
+                section=get("section"),
+                row=get("row"),
+                position_from_N=pos,
+                direction=get("direction"),
+            ))
+        elif type(loc) is str:
+            self._push("n_location", _parse_location_string(loc))
+        else:
+            self.n_location = None
+
+    # Temperature messages: keep full plants list so canopy_temperature_data is nested array
+    def _handle_temperature(self, data: TemperatureMsg):
+        plants = data.get("plants")
+        if plants and type(plants) is list:
+            processed_plants = []
+            for p in plants:
+                if type(p) is str:
+                    parsed = _parse_plant_string(p)
+                    if parsed:
+                        processed_plants.append(parsed)
+                elif type(p) is dict:
+                    processed_plants.append(p)
+
+            self._push("t_plants", processed_plants)
+            # entity count fallback
+            self.t_entity_count = data.get("entity_count", len(self.t_plants))
+            # keep an average for backward compatibility (optional)
+            if self.COMPUTE_CANOPY_AVG:
+                try:
+                    self.t_canopy_temperature = _canopy_mean(processed_plants)
+                except (ValueError, TypeError):
+                    self.t_canopy_temperature = None
             else:
-                # unknown messages: keep raw if needed
-                pass
+                self.t_canopy_temperature = None
+        else:
+            # older flat format
+            get = data.get
+            self.t_entity_count = get("entity_count")
+            self._push("t_canopy_temperature", get("canopy_temperature"))
+            self.t_cswi = get("cwsi")
 
-            # mark data available for your publishing loop
-            self._is_data_available = True
+    def _handle_tf_position(self, data: TfPositionMsg):
+        # store tf/utm baselink values (x,y,z)
+        try:
+            # one lookup per key instead of an "in" test followed by a get
+            x, y, z = data["x"], data["y"], data["z"]
+        except KeyError:
+            p = data.get("point")
+            if type(p) is not dict:
+                return
+            get = p.get
+            x, y, z = get("x"), get("y"), get("z")
+        try:
+            x, y, z = float(x), float(y), float(z)
+        except (ValueError, TypeError):
+            pass
+        self._push("tf_x", x); self._push("tf_y", y); self._push("tf_z", z)
 
-        except Exception as e:
-            print(f"[ERROR] Error processing MQTT message in ros_data.update: {e}")
+    def _push(self, name: str, value) -> None:
+        """Store the latest value of a buffered field and queue it for the publisher."""
+        setattr(self, name, value)
+        # None and NaN (the only value not equal to itself) never reach the publisher
+        if value is not None and value == value:
+            self.buffers[name].append(value)
+
+    def drain(self, name: str) -> list:
+        """Pop every value queued for a buffered field since the last drain."""
+        buf = self.buffers[name]
+        out = []
+        while buf:
+            out.append(buf.popleft())
+        return out
+
+# Handlers that only copy payload keys into fields:
+# msg_type -> ((field, (payload keys in order of preference)), ...)
+_COPY_SCHEMA = {
+    # GPS / position messages: prefer "ts" then "timestamp"
+    "gps": (
+        ("g_timestamp", ("ts", "timestamp")),
+        ("g_latitude", ("latitude",)),
+        ("g_longitude", ("longitude",)),
+        ("g_altitude", ("altitude",)),
+        ("g_status", ("status",)),
+        ("g_service", ("service",)),
+    ),
+    "ambient_temperature": (("n_ambient_temperature", ("ambient_temperature",)),),
+    # NDVI messages: accept variant field names
+    "ndvi": (
+        ("n_ndvi", ("ndvi", "ndvi_value")),
+        ("n_ndvi_3d", ("ndvi_3d", "ndvi3d")),
+        ("n_ir", ("ndvi_ir", "ir")),
+        ("n_visible", ("ndvi_visible", "visible")),
+    ),
+    "area": (("n_area", ("area",)),),
+    "biomass": (("n_biomass", ("biomass",)),),
+    # some payloads use crop_light_state or light_state
+    "light_state": (("n_crop_light_state", ("crop_light_state", "light_state")),),
+    "crop_type": (("n_crop_type", ("crop_type",)),),
+    "relative_humidity": (("n_relative_humidity", ("relative_humidity", "humidity")),),
+    "absolute_humidity": (("n_absolute_humidity", ("absolute_humidity",)),),
+    "dew_point": (("n_dew_point", ("dew_point",)),),
+}
+
+
+def _compile_copy_handler(msg_type: str, fields) -> Any:
+    """
+    Generate a straight-line handler for a _COPY_SCHEMA entry, e.g. for "area":
+      def _handle_area(self, data):
+          v = data.get('area')
+          self.n_area = v
+          if v is not None and v == v:
+              self.buffers['n_area'].append(v)
+    (same semantics as ros_data_t._push, without the setattr/call overhead)
+    Handlers reading several keys, e.g. the GPS one, bind data.get once:
+          get = data.get
+          ...
+          self.g_latitude = get('latitude')
+    """
+    name = f"_handle_{msg_type}"
+    namespace: Dict[str, Any] = {}
+    lines = [f"def {name}(self, data):"]
+
+    # bind data.get once when the handler reads more than one key with it
+    gets = sum(len(keys) for _, keys in fields)
+    get = "get" if gets > 1 else "data.get"
+    if gets > 1:
+        lines.append("    get = data.get")
+
+    for attr, keys in fields:
+        if len(keys) == 1 and attr not in BUFFERED_FIELDS:
+            # plain copy, all payload keys are optional
+            lines.append(f"    self.{attr} = {get}({keys[0]!r})")
+            continue
+        lines.append(f"    v = {get}({keys[0]!r})")
+        for key in keys[1:]:
+            lines.append("    if v is None:")
+            lines.append(f"        v = {get}({key!r})")
+        lines.append(f"    self.{attr} = v")
+        if attr in BUFFERED_FIELDS:
+            lines.append("    if v is not None and v == v:")
+            lines.append(f"        self.buffers[{attr!r}].append(v)")
+    exec(compile("\n".join(lines), f"<ros_data {name}>", "exec"), namespace)
+    return namespace[name]
+
+
+# msg_type tokens in matching order for the substring fallback in
+# _match_handler: "ambient_temperature" must be tried before "temperature".
+_MSG_TYPES = (
+    "gps", "ambient_temperature", "ndvi", "area", "location", "biomass",
+    "light_state", "crop_type", "temperature", "relative_humidity",
+    "absolute_humidity", "dew_point", "tf_position",
+)
+
+# msg_type -> handler(self, data)
+_HANDLERS = {
+    msg_type: (_compile_copy_handler(msg_type, _COPY_SCHEMA[msg_type]) if msg_type in _COPY_SCHEMA
+               else getattr(ros_data_t, f"_handle_{msg_type}"))
+    for msg_type in _MSG_TYPES
+}
+
+
+# msg_type variants already resolved by _match_handler (None for unknown types)
+_MATCH_CACHE: Dict[str, Any] = {}
+_MATCH_CACHE_MAXSIZE = 256
+
+
+def _match_handler(msg: str):
+    """Find the handler for a msg_type that contains a known token (e.g. "gps_fix")."""
+    try:
+        return _MATCH_CACHE[msg]
+    except KeyError:
+        pass
+    handler = None
+    for token, candidate in _HANDLERS.items():
+        if token in msg:
+            handler = candidate
+            break
+    # the substring scan runs once per distinct msg_type (bounded for unexpected senders)
+    if len(_MATCH_CACHE) < _MATCH_CACHE_MAXSIZE:
+        _MATCH_CACHE[msg] = handler
+    return handler
+
+def _extract_float(s: str) -> Optional[float]:
+    r"""
+    Return the first number found in s, e.g. 11.64 for '11.64 m', or None.
+    Same match as the regex [-+]?[0-9]*\.?[0-9]+ (_FLOAT_RE).
+    """
+    # fast path: the number is the first token ("11.64 m", "3.5")
+    head = s.split(None, 1)
+    if head:
+        tok = head[0]
+        if not tok.strip("+-.0123456789"):  # only sign/digit/dot characters
+            try:
+                return float(tok)
+            except ValueError:
+                pass
+
+    m = _FLOAT_RE.search(s)
+    return float(m.group(1)) if m else None
 
-        
-    def is_data_available(self) -> bool:
-        return self._is_data_available
 
 def _parse_plant_string(s: str) -> Optional[Dict[str, Any]]:
     """
@@ -179,10 +396,10 @@ def _parse_plant_string(s: str) -> Optional[Dict[str, Any]]:
       { "id": 8, "canopy_temperature": 21.54, "cswi": -0.09, "area": 21.33 }
     """
     # Regex to find all key-value pairs
-    pairs = re.findall(r'([a-zA-Z\s]+)\s*=\s*([-\d.]+)', s)
+    pairs = _PLANT_PAIR_RE.findall(s)
     
     # Regex to find the object ID specifically
-    obj_id_match = re.search(r'Objeto\s+(\d+)', s)
+    obj_id_match = _PLANT_ID_RE.search(s)
     
     if not obj_id_match:
         return None
@@ -209,76 +426,79 @@ def _parse_plant_string(s: str) -> Optional[Dict[str, Any]]:
         
     return plant_data
 
-def _parse_location_string(s: str) -> Dict[str, Any]:
+# observed raw directions (lowercased) -> normalized direction; anything else
+# falls back to the generic normalization in _parse_location_string
+_DIR_MAP = {
+    f"{a}{sep}{b}": "South → North"
+    for a, b in (("north", "south"), ("south", "north"))
+    for sep in (" → ", "→", " -> ", "->", " to ")
+}
+
+def _parse_location_string(s: str) -> LocationT:
     """
     Parse a location string like:
       'section: open air, row: row1-2, position_from_N: 11.64 m, direction: North → South'
-    into a dict:
-      { "section": "...", "row": "...", "position_from_N": 11.64, "direction": "South → North" }
+    into a LocationT:
+      LocationT(section="...", row="...", position_from_N=11.64, direction="South → North")
     """
-    out: Dict[str, Any] = {
-        "section": None,
-        "row": None,
-        "position_from_N": None,
-        "direction": None
-    }
+    out = LocationT()
 
     if not s or not isinstance(s, str):
         return out
 
-    # split by commas, then extract key:value pairs
-    parts = [p.strip() for p in re.split(r',\s*', s) if p.strip()]
-    for p in parts:
-        if ':' in p:
-            k, v = [x.strip() for x in p.split(':', 1)]
+    # tokenize all comma separated key:value parts in a single pass
+    for m in _LOC_PART_RE.finditer(s):
+        k, v = m.group('key', 'val')
+        v = v.strip()
+        if k is not None:
+            k = k.strip()
             kl = k.lower()
             if 'section' in kl:
                 val = v.strip()
                 # normalize "open air" to example format
                 if 'open air' in val.lower():
-                    out['section'] = "section 3 (Open air)"
+                    out.section = "section 3 (Open air)"
                 else:
-                    out['section'] = val.title()
+                    out.section = val.title()
             elif 'row' in kl:
                 rv = v.strip().lower()
                 # keep row token, remove spaces
                 # if pattern rowNN-NN, try to sanitize by removing spaces
-                m = re.search(r'(\d+)(?:\s*-\s*(\d+))?', rv)
-                if m:
-                    if m.group(2):
+                rm = _ROW_RE.search(rv)
+                if rm:
+                    if rm.group(2):
                         # combine numbers (e.g. "1-2" -> "1-2") keep dash, or join? keep original compact
-                        out['row'] = f"row{m.group(1)}-{m.group(2)}"
+                        out.row = f"row{rm.group(1)}-{rm.group(2)}"
                     else:
-                        out['row'] = f"row{m.group(1)}"
+                        out.row = f"row{rm.group(1)}"
                 else:
-                    out['row'] = rv
+                    out.row = rv
             elif 'position' in kl or 'position_from_n' in kl:
                 # extract float (meters)
-                m = re.search(r'([-+]?[0-9]*\.?[0-9]+)', v)
-                if m:
-                    try:
-                        out['position_from_N'] = float(m.group(1))
-                    except Exception:
-                        out['position_from_N'] = None
-                else:
-                    out['position_from_N'] = None
+                out.position_from_N = _extract_float(v)
             elif 'direction' in kl:
-                dv = v.replace('->', '→').replace('to', '→').strip()
-                # Normalize order: prefer "South → North" if both present
-                low = dv.lower()
-                if 'north' in low and 'south' in low:
-                    out['direction'] = "South → North"
-                else:
-                    out['direction'] = dv
+                # common spellings resolve with one lookup
+                canonical = _DIR_MAP.get(v.lower())
+                if canonical is None:
+                    dv = v.replace('->', '→').replace('to', '→').strip()
+                    # Normalize order: prefer "South → North" if both present
+                    low = dv.lower()
+                    if 'north' in low and 'south' in low:
+                        canonical = "South → North"
+                    else:
+                        canonical = dv
+                out.direction = canonical
             else:
                 # unknown key: store raw
-                out[k] = v
-        else:
+                if out.extra is None:
+                    out.extra = {}
+                out.extra[k] = v
+        elif v:
             # no colon: try to detect direction token or single value
-            low = p.lower()
+            low = v.lower()
             if 'north' in low or 'south' in low:
                 if 'north' in low and 'south' in low:
-                    out['direction'] = "South → North"
+                    out.direction = "South → North"
                 else:
-                    out['direction'] = p
+                    out.direction = v
     return out
\ No newline at end of file